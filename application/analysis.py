@@ -6,11 +6,17 @@ https://creativecommons.org/licenses/by-sa/4.0/
 
 import cv2
 import numpy
+import pandas
 import csv
 import time
 import base64
+import io
 import json
 import os
+from concurrent.futures import ThreadPoolExecutor
+from functools    import lru_cache
+from multiprocessing import shared_memory, resource_tracker
+from queue        import Queue, Empty, Full
 from scipy.signal import find_peaks
 from threading    import Thread, Lock
 from module       import Module
@@ -20,6 +26,20 @@ class Analysis(Module):
     Class for spectrogram analysis.
     Inherits from the base Module class.
     """
+    # Reference CSV columns read at start-up ("wavelength" only identifies legacy files)
+    _REFERENCE_COLUMNS = frozenset((
+        "substance","ion_state","source","captured_at",
+        "pixel_to_nm_factor","pixel_to_nm_offset","spectrum_values","spectrum","wavelength"
+    ))
+    # Columns written for each captured reference spectrum
+    _REFERENCE_FIELDNAMES = (
+        "substance","ion_state","source","captured_at",
+        "pixel_to_nm_factor","pixel_to_nm_offset","spectrum_length","spectrum_values"
+    )
+    _SPECTROGRAM_KEYS = ("raw_spectrogram","processed_spectrogram","normalized_spectrogram")
+    # BT.601 weights in BGR order, the same ones used by cv2.COLOR_BGR2GRAY
+    _LUMINANCE_WEIGHTS = numpy.array([0.114,0.587,0.299],dtype=numpy.float32)
+
     def __init__(self,config,networkConfig,systemConfig):
         super().__init__("Analysis",networkConfig,systemConfig)
         self.config                = config
@@ -28,21 +48,40 @@ class Analysis(Module):
         self.referenceSpectraPath  = self.config['reference_spectra_path']
         self.toleranceNm           = self.config['tolerance_nm']
         self.referenceSpectra      = None
-        self.baseIntensityProfile  = self.config.get("base_intensity_profile")
+        self.baseIntensityProfile  = self._load_base_profile(self.config.get("base_intensity_profile"))
         self.calibrationInProgress = False
         self._config_path          = self.systemConfig.get("config_path","config.json")
         self._newSubstanceLock     = Lock()
         self._newSubstanceState    = None
         self._referenceLock        = Lock()
+        self._alignedReferences    = {}
+        self._referenceFile        = None
+        self._referenceWriter      = None
+        self._previewQueue         = Queue(maxsize=1)
+        self._previewThread        = None
+        self._frameSegment         = None
+        workers = int(max(1.0,self._safe_float(self.config.get("analysis_workers"),default=2.0)))
+        self._workerPool           = ThreadPoolExecutor(max_workers=workers,thread_name_prefix="analysis")
         tolerance = self.config.get("profile_match_tolerance",0.20)
         try:
             tolerance = float(tolerance)
         except (TypeError,ValueError):
             tolerance = 0.05
         self.profileMatchTolerance = max(0.0,tolerance)
+        self.pixelToNmFactor       = self._safe_float(self.config.get("pixel_to_nm_factor"),default=0.5)
+        self.pixelToNmOffset       = self._safe_float(self.config.get("pixel_to_nm_offset"),default=400.0)
+        previewQuality = self._safe_float(self.config.get("preview_jpeg_quality"),default=70.0)
+        self.previewJpegQuality    = int(min(100.0,max(1.0,previewQuality)))
+        intensityChannel = str(self.config.get("intensity_channel","luminance")).lower()
+        self.intensityChannel      = intensityChannel if intensityChannel in ("luminance","green") else "luminance"
+        self.binarySpectrogramPayload = bool(self.config.get("binary_spectrogram_payload",False))
+        self.sendRoiPreview        = bool(self.config.get("send_roi_preview",True))
+        referenceStorage = str(self.config.get("reference_spectra_storage","json")).lower()
+        self.referenceSpectraStorage = referenceStorage if referenceStorage in ("json","npy") else "json"
 
         x, y, w, h = [int(round(float(value))) for value in self.config.get("manual_rect")]
         self.manualRect = (x, y, w, h)
+        self._roiBounds = None
 
     def onStart(self):
         """
@@ -50,56 +89,88 @@ class Analysis(Module):
         Loads the reference data and registers with the EventManager.
         """
         self.sendMessage("EventManager", "Register")
+        if self.sendRoiPreview:
+            self._previewThread = Thread(target=self._preview_loop,daemon=True)
+            self._previewThread.start()
         try:
-            with open(self.referenceSpectraPath,newline='') as csvfile:
-                reader = csv.DictReader(csvfile)
-                spectra = []
-                for rowNumber,row in enumerate(reader,start=1):
-                    if not row:
-                        continue
-
-                    rawSpectrum = row.get("spectrum_values") or row.get("spectrum")
-                    if not rawSpectrum:
-                        # Fallback for legacy files containing single peak data.
-                        wavelengthRaw = row.get("wavelength")
-                        if wavelengthRaw is not None:
-                            self.log(
-                                "WARNING",
-                                f"Legacy reference entry detected at line {rowNumber}; skipping because full spectrum data is required."
-                            )
-                        continue
+            spectra = []
+            for rowNumber,row in enumerate(self._read_reference_rows(),start=1):
+                if not row:
+                    continue
 
-                    spectrumArray = self._parse_reference_spectrum(rawSpectrum)
-                    if spectrumArray is None or spectrumArray.size == 0:
-                        self.log("WARNING",f"Reference entry at line {rowNumber} discarded: spectrum data is empty or invalid.")
-                        continue
+                rawSpectrum = row.get("spectrum_values") or row.get("spectrum")
+                if not rawSpectrum:
+                    # Fallback for legacy files containing single peak data.
+                    wavelengthRaw = row.get("wavelength")
+                    if wavelengthRaw is not None:
+                        self.log(
+                            "WARNING",
+                            f"Legacy reference entry detected at line {rowNumber}; skipping because full spectrum data is required."
+                        )
+                    continue
 
-                    spectra.append({
-                        "substance"            : row.get("substance","Unknown"),
-                        "ion_state"            : row.get("ion_state",""),
-                        "source"               : row.get("source",""),
-                        "captured_at"          : row.get("captured_at",""),
-                        "pixel_to_nm_factor"   : self._safe_float(row.get("pixel_to_nm_factor"),default=self.config.get("pixel_to_nm_factor")),
-                        "pixel_to_nm_offset"   : self._safe_float(row.get("pixel_to_nm_offset"),default=self.config.get("pixel_to_nm_offset")),
-                        "spectrum"             : spectrumArray
-                    })
+                spectrumArray = self._parse_reference_spectrum(rawSpectrum)
+                if spectrumArray is None or spectrumArray.size == 0:
+                    self.log("WARNING",f"Reference entry at line {rowNumber} discarded: spectrum data is empty or invalid.")
+                    continue
 
+                spectra.append({
+                    "substance"            : row.get("substance","Unknown"),
+                    "ion_state"            : row.get("ion_state",""),
+                    "source"               : row.get("source",""),
+                    "captured_at"          : row.get("captured_at",""),
+                    "pixel_to_nm_factor"   : row.get("pixel_to_nm_factor"),
+                    "pixel_to_nm_offset"   : row.get("pixel_to_nm_offset"),
+                    "spectrum"             : spectrumArray
+                })
+
+            with self._referenceLock:
                 self.referenceSpectra = spectra
-                if not spectra:
-                    self.log(
-                        "WARNING",
-                        f"Reference spectra file '{self.referenceSpectraPath}' is empty. Analysis will run without reference matches until data is added."
-                    )
-                else:
-                    self.log(
-                        "INFO",
-                        f"Reference spectra loaded successfully from {self.referenceSpectraPath} ({len(self.referenceSpectra)} entries)."
-                    )
+                self._alignedReferences = {}
+            if not spectra:
+                self.log(
+                    "WARNING",
+                    f"Reference spectra file '{self.referenceSpectraPath}' is empty. Analysis will run without reference matches until data is added."
+                )
+            else:
+                # Align the references to the configured ROI width now rather than on the first analysis
+                if self.manualRect[2] > 0:
+                    self._get_aligned_references(self.manualRect[2])
+                self.log(
+                    "INFO",
+                    f"Reference spectra loaded successfully from {self.referenceSpectraPath} ({len(self.referenceSpectra)} entries)."
+                )
         except FileNotFoundError:
             self.log("ERROR", f"Reference file not found at {self.referenceSpectraPath}. Analysis module will not work correctly.")
         except Exception as e:
             self.log("ERROR", f"Failed to load reference spectra from {self.referenceSpectraPath}. Error: {e}")
 
+    def _read_reference_rows(self):
+        """
+        Reads the reference spectra CSV in bulk and returns its rows as dictionaries.
+        The pixel to nm calibration columns are converted to floats column-wise, falling back
+        to the configured values; all other fields are kept as strings. An empty file yields no rows.
+        """
+        try:
+            frame = pandas.read_csv(
+                self.referenceSpectraPath,
+                dtype=str,
+                keep_default_na=False,
+                usecols=lambda column: column in self._REFERENCE_COLUMNS
+            )
+        except pandas.errors.EmptyDataError:
+            return []
+
+        for column in ("pixel_to_nm_factor","pixel_to_nm_offset"):
+            default = self._safe_float(self.config.get(column))
+            if column in frame.columns:
+                values = pandas.to_numeric(frame[column].str.strip(),errors="coerce")
+                # object dtype so that a missing default stays None rather than NaN
+                frame[column] = values.astype(object).where(values.notna(),default)
+            else:
+                frame[column] = default
+        return frame.to_dict("records")
+
     def handleMessage(self,message):
         """
         Handles incoming messages.
@@ -145,18 +216,30 @@ class Analysis(Module):
                                     )
                     return
 
+            frameInfo = payload.get("frame")
             imageB64 = payload.get("image")
-            if not imageB64:
+            if not frameInfo and not imageB64:
                 errorMsg = "'Analyze' command received without image data."
                 self.sendMessage("All","AnalysisError",{"message": errorMsg})
                 if self.calibrationInProgress:
                     self._calibrationFailed(errorMsg)
                 return
 
-            # Decode the image from Base64
-            imgBytes = base64.b64decode(imageB64)
-            imgNp = numpy.frombuffer(imgBytes,dtype=numpy.uint8)
-            imageData = cv2.imdecode(imgNp,cv2.IMREAD_COLOR)
+            cropped = False
+            if frameInfo:
+                # Raw frame shared by the Camera module: only the ROI is copied out
+                imageData = self._read_shared_frame(frameInfo)
+                if imageData is None:
+                    # Overwritten frame, or a segment this process cannot attach (e.g. the camera runs
+                    # on another host): ask for the frame as a JPEG instead. A segment that cannot be
+                    # attached at all also tells the camera to stop sharing frames with this module.
+                    unreachable = self._frameSegment is None
+                    self.log("WARNING","Shared frame unavailable, requesting a JPEG capture from the camera.")
+                    self.sendMessage("Camera","Analyze",{"shared": False,"shared_unreachable": unreachable})
+                    return
+                cropped = True
+            else:
+                imageData = self._decode_image(imageB64)
 
             if imageData is None:
                 errorMsg = "Failed to decode image data for analysis."
@@ -165,12 +248,86 @@ class Analysis(Module):
                     self._calibrationFailed(errorMsg)
                 return
 
-            # Start the appropriate processing in a separate thread to avoid blocking
+            # Run the appropriate processing on the worker pool to avoid blocking
             if self.calibrationInProgress:
-                worker = Thread(target=self._performCalibration,args=(imageData,))
+                self._workerPool.submit(self._performCalibration,imageData,cropped)
             else:
-                worker = Thread(target=self.performAnalysis,args=(imageData,))
-            worker.start()
+                self._workerPool.submit(self.performAnalysis,imageData,cropped)
+
+    def _decode_image(self,imageB64):
+        """
+        Decodes a Base64 encoded image, straight to grayscale unless the green channel is analysed.
+
+        Returns:
+            numpy.ndarray: The decoded image, or None if it cannot be decoded.
+        """
+        imageBytes = base64.b64decode(imageB64)
+        flags = cv2.IMREAD_COLOR if self.intensityChannel == "green" else cv2.IMREAD_GRAYSCALE
+        return cv2.imdecode(numpy.frombuffer(imageBytes,dtype=numpy.uint8),flags)
+
+    def _read_shared_frame(self,frameInfo):
+        """
+        Copies the ROI of a raw frame out of the shared memory segment published by the Camera module.
+        The copy is taken immediately so that the camera can reuse the segment for the next capture;
+        only the ROI rows and columns are copied, the rest of the frame is never touched.
+        The segment header must hold the sequence number of the payload both before and after
+        the copy, otherwise the camera has overwritten the frame in the meantime.
+
+        Returns:
+            numpy.ndarray: The ROI of the frame, or None if the segment cannot be read.
+        """
+        try:
+            name = frameInfo["shm"]
+            shape = tuple(int(value) for value in frameInfo["shape"])
+            dtype = numpy.dtype(frameInfo.get("dtype","uint8"))
+            offset = int(frameInfo.get("offset",0))
+            sequence = frameInfo.get("sequence")
+
+            if self._frameSegment is None or self._frameSegment.name != name:
+                self._release_frame_segment()
+                self._frameSegment = self._attach_frame_segment(name)
+
+            buffer = self._frameSegment.buf
+            header = numpy.ndarray((1,),dtype=numpy.uint64,buffer=buffer) if sequence is not None else None
+            if header is not None and int(header[0]) != int(sequence):
+                raise RuntimeError(f"frame {sequence} was overwritten before it was read")
+
+            frame = numpy.ndarray(shape,dtype=dtype,buffer=buffer,offset=offset)
+            xStart,yStart,xEnd,yEnd = self._roi_bounds(shape[0],shape[1])
+            roi = frame[yStart:yEnd,xStart:xEnd].copy()
+
+            if header is not None and int(header[0]) != int(sequence):
+                raise RuntimeError(f"frame {sequence} was overwritten while it was read")
+            return roi
+        except Exception as exc:
+            self.log("WARNING",f"Failed to read shared frame: {exc}")
+            return None
+
+    @staticmethod
+    def _attach_frame_segment(name):
+        """
+        Attaches to a frame segment owned by the Camera module without letting this
+        process unlink it on exit.
+        """
+        try:
+            return shared_memory.SharedMemory(name=name,track=False)
+        except TypeError:
+            # Before Python 3.13 attached segments are always tracked. The tracker registers the
+            # POSIX name, which is the public name with its leading slash.
+            segment = shared_memory.SharedMemory(name=name)
+            resource_tracker.unregister(f"/{segment.name}","shared_memory")
+            return segment
+
+    def _release_frame_segment(self):
+        """
+        Detaches from the shared frame segment, if any.
+        """
+        if self._frameSegment is not None:
+            try:
+                self._frameSegment.close()
+            except Exception:
+                pass
+            self._frameSegment = None
 
     def _handleNewSubstanceCapture(self,payload):
         """
@@ -194,18 +351,16 @@ class Analysis(Module):
             if not imageB64:
                 raise ValueError("Camera response did not include image data.")
 
-            imageBytes = base64.b64decode(imageB64)
-            imageNp = numpy.frombuffer(imageBytes,dtype=numpy.uint8)
-            imageData = cv2.imdecode(imageNp,cv2.IMREAD_COLOR)
+            imageData = self._decode_image(imageB64)
             if imageData is None:
                 raise ValueError("Failed to decode image data for new substance acquisition.")
 
-            intensityProfile = numpy.asarray(self.extractSpectrogramProfile(imageData),dtype=numpy.float32)
+            intensityProfile = self.extractSpectrogramProfile(imageData)
             if intensityProfile.size == 0:
                 raise ValueError("Extracted intensity profile is empty.")
 
-            pixelToNmFactor = self.config.get("pixel_to_nm_factor",0.5)
-            pixelOffset = self.config.get("pixel_to_nm_offset",400.0)
+            pixelToNmFactor = self.pixelToNmFactor
+            pixelOffset = self.pixelToNmOffset
 
             peakIdx = int(numpy.argmax(intensityProfile))
             peakValue = float(intensityProfile[peakIdx])
@@ -286,17 +441,17 @@ class Analysis(Module):
         except Exception as exc:
             self._calibrationFailed(f"Failed to request calibration image: {exc}")
 
-    def _performCalibration(self,imageData):
+    def _performCalibration(self,imageData,cropped=False):
         """
         Processes the calibration image, stores the baseline intensity profile,
         and persists it to the configuration file.
         """
         try:
-            intensityProfile = self.extractSpectrogramProfile(imageData)
+            intensityProfile = self.extractSpectrogramProfile(imageData,cropped)
             if intensityProfile is None or len(intensityProfile) == 0:
                 raise ValueError("Extracted calibration intensity profile is empty.")
 
-            baseProfile = [float(value) for value in numpy.asarray(intensityProfile).tolist()]
+            baseProfile = numpy.asarray(intensityProfile,dtype=numpy.float32)
             self.baseIntensityProfile = baseProfile
             self.config["base_intensity_profile"] = baseProfile
             self._persist_base_profile(baseProfile)
@@ -312,16 +467,28 @@ class Analysis(Module):
         """
         Persists the base intensity profile to the JSON configuration file.
         """
+        # Converted to plain floats only here; float32 noise is rounded away to keep the file readable
+        baseList = numpy.round(numpy.asarray(baseProfile,dtype=numpy.float64),4).tolist()
         try:
             with open(self._config_path,"r",encoding="utf-8") as cfgFile:
                 data = json.load(cfgFile)
 
             modulesCfg = data.setdefault("modules",{})
             analysisCfg = modulesCfg.setdefault("analysis",{})
-            analysisCfg["base_intensity_profile"] = baseProfile
+            analysisCfg["base_intensity_profile"] = baseList
 
-            with open(self._config_path,"w",encoding="utf-8") as cfgFile:
-                json.dump(data,cfgFile,indent=2)
+            # Serialize in one call and write once instead of streaming many small chunks;
+            # the new file replaces the old one atomically so a crash cannot leave it truncated
+            serialized = json.dumps(data,indent=2)
+            tmpPath = f"{self._config_path}.tmp"
+            try:
+                with open(tmpPath,"w",encoding="utf-8") as cfgFile:
+                    cfgFile.write(serialized)
+                os.replace(tmpPath,self._config_path)
+            except Exception:
+                if os.path.exists(tmpPath):
+                    os.remove(tmpPath)
+                raise
         except FileNotFoundError as exc:
             raise RuntimeError(f"Configuration file '{self._config_path}' not found.") from exc
         except Exception as exc:
@@ -335,19 +502,20 @@ class Analysis(Module):
         self.sendMessage("All","AnalysisCalibration",{"status": "error","message": message})
         self.log("ERROR",f"Calibration failed: {message}")
 
-    def performAnalysis(self,imageData):
+    def performAnalysis(self,imageData,cropped=False):
         """
         Performs a complete analysis of a spectroscopic absorption image
         by orchestrating the four phases of the analysis pipeline.
         
         Args:
-            imageData (numpy.ndarray): The pixel matrix of the color image.
+            imageData (numpy.ndarray): The pixel matrix of the image, grayscale or BGR.
+            cropped (bool): True if imageData is already cropped to the ROI.
         """
         self.log("INFO","Starting absorption spectrogram analysis...")
         
         try:
             # Phase 1: Data Extraction and Pre-processing
-            intensityProfile = numpy.asarray(self.extractSpectrogramProfile(imageData),dtype=numpy.float32)
+            intensityProfile = self.extractSpectrogramProfile(imageData,cropped)
             if intensityProfile.size == 0:
                 raise ValueError("Empty intensity profile extracted from image.")
 
@@ -374,17 +542,51 @@ class Analysis(Module):
             self.log("ERROR",{"error": str(e)})
             self.sendMessage("All","AnalysisError",{"error": str(e)})
 
-    def extractSpectrogramProfile(self,imageData):
+    def extractSpectrogramProfile(self,imageData,cropped=False):
         """
         Extracts and pre-processes the 1D intensity profile from a 2D image.
         
         Args:
-            imageData (numpy.ndarray): The pixel matrix of the color image.
+            imageData (numpy.ndarray): The pixel matrix of the image, grayscale or BGR.
+            cropped (bool): True if imageData is already cropped to the ROI.
             
         Returns:
-            numpy.ndarray: The 1D intensity profile.
+            numpy.ndarray: The 1D float32 intensity profile, one value per ROI column.
         """
-        height,width = imageData.shape[:2]
+        if cropped:
+            roi = imageData
+        else:
+            height,width = imageData.shape[:2]
+            xStart,yStart,xEnd,yEnd = self._roi_bounds(height,width)
+            roi = imageData[yStart:yEnd,xStart:xEnd]
+
+        # The GUI preview is encoded by the preview thread so the analysis is not delayed;
+        # only the latest ROI is kept, a preview still waiting to be encoded is dropped
+        if self.sendRoiPreview:
+            self._queue_preview(roi.copy())
+
+        # Calculating the 1D intensity profile by averaging along the rows
+        if roi.ndim == 2:
+            return cv2.reduce(roi,0,cv2.REDUCE_AVG,dtype=cv2.CV_32F).ravel()
+
+        # Averaging is linear: the colour channels are averaged first and only the
+        # resulting row is converted, instead of converting every pixel of the ROI
+        channelMeans = cv2.reduce(roi,0,cv2.REDUCE_AVG,dtype=cv2.CV_32F).reshape(-1,roi.shape[2])
+        if self.intensityChannel == "green":
+            return numpy.ascontiguousarray(channelMeans[:,1])
+        return channelMeans[:,:3] @ self._LUMINANCE_WEIGHTS
+
+    def _roi_bounds(self,height,width):
+        """
+        Clips the configured manual ROI to the given image dimensions.
+        The bounds are computed, and logged, only when the image size changes.
+
+        Returns:
+            tuple: (xStart, yStart, xEnd, yEnd) of the ROI.
+        """
+        cached = self._roiBounds
+        if cached is not None and cached[0] == (height,width):
+            return cached[1]
 
         x,y,w,h = self.manualRect
         xStart  = max(0,int(x))
@@ -394,56 +596,109 @@ class Analysis(Module):
         if xEnd <= xStart or yEnd <= yStart:
             raise ValueError("Configured manual ROI is invalid for the current image dimensions.")
 
+        bounds = (xStart,yStart,xEnd,yEnd)
+        self._roiBounds = ((height,width),bounds)
         self.log("INFO",f"Using manual ROI: x={xStart}, y={yStart}, width={xEnd - xStart}, height={yEnd - yStart}.")
-        roi = imageData[yStart:yEnd,xStart:xEnd]
+        return bounds
+
+    def _queue_preview(self,roi):
+        """
+        Queues an ROI image for the preview thread without ever blocking the caller.
+        """
+        while True:
+            try:
+                self._previewQueue.put_nowait(roi)
+                return
+            except Full:
+                try:
+                    self._previewQueue.get_nowait()
+                    self._previewQueue.task_done()
+                except Empty:
+                    pass
 
-        roiGray = cv2.cvtColor(roi,cv2.COLOR_BGR2GRAY)
+    def _preview_loop(self):
+        """
+        Encodes the latest queued ROI image and sends it to the GUI,
+        keeping JPEG encoding out of the analysis and calibration path.
+        """
+        while not self.stopEvent.is_set():
+            try:
+                roi = self._previewQueue.get(block=True,timeout=self.queueTimeout)
+            except Empty:
+                continue
 
-        def encode_image_to_base64(image):
-            success, buffer = cv2.imencode(".jpg", image)
-            if not success:
-                raise RuntimeError("Failed to encode ROI image.")
-            return base64.b64encode(buffer).decode("utf-8")
-            
-        try:
-            roi_b64 = encode_image_to_base64(roi)
-            self.sendMessage("GUI","PictureTaken",{"image": roi_b64})
-            self.log("INFO","ROI extracted and sent to GUI.")
-        except Exception as exc:
-            self.log("WARNING",f"Failed to send ROI to GUI: {exc}")
-        
-        # Calculating the 1D intensity profile by averaging along the rows
-        intensityProfile = numpy.mean(roiGray,axis=0)
-        
-        return intensityProfile
+            try:
+                success, buffer = cv2.imencode(".jpg", roi, [cv2.IMWRITE_JPEG_QUALITY, self.previewJpegQuality])
+                if not success:
+                    raise RuntimeError("Failed to encode ROI image.")
+                roi_b64 = base64.b64encode(buffer).decode("ascii")
+                self.sendMessage("GUI","PictureTaken",{"image": roi_b64})
+                self.log("INFO","ROI extracted and sent to GUI.")
+            except Exception as exc:
+                self.log("WARNING",f"Failed to send ROI to GUI: {exc}")
+            finally:
+                self._previewQueue.task_done()
 
     def _parse_reference_spectrum(self,rawSpectrum):
         """
-        Converts a serialized spectrum payload into a numpy array.
+        Converts a serialized spectrum payload into a numpy array. The payload is either
+        the spectrum values or the path, relative to the reference CSV, of a .npy file.
         """
         if rawSpectrum is None:
             return None
 
+        if str(rawSpectrum).strip().lower().endswith(".npy"):
+            spectrumPath = os.path.join(os.path.dirname(self.referenceSpectraPath),str(rawSpectrum).strip())
+            try:
+                # Memory-mapped: the samples are read straight from the file, without parsing
+                spectrumArray = numpy.load(spectrumPath,mmap_mode="r")
+            except (OSError,ValueError) as exc:
+                self.log("WARNING",f"Failed to load reference spectrum '{spectrumPath}': {exc}")
+                return None
+            return spectrumArray.ravel() if spectrumArray.dtype == numpy.float32 else spectrumArray.astype(numpy.float32).ravel()
+
         spectrumArray = None
         try:
             loaded = json.loads(rawSpectrum)
             if isinstance(loaded,list):
-                spectrumArray = numpy.asarray([float(item) for item in loaded],dtype=numpy.float32)
+                # Converted in one call by NumPy instead of one float() per sample
+                spectrumArray = numpy.asarray(loaded,dtype=numpy.float32)
+                if spectrumArray.ndim != 1 or None in loaded:
+                    spectrumArray = None
         except (json.JSONDecodeError,TypeError,ValueError):
             spectrumArray = None
 
         if spectrumArray is None:
-            values = []
-            for token in str(rawSpectrum).replace(";", " ").split():
-                try:
-                    values.append(float(token))
-                except (TypeError,ValueError):
-                    continue
-            if values:
-                spectrumArray = numpy.asarray(values,dtype=numpy.float32)
+            tokens = str(rawSpectrum).replace(";"," ").replace(","," ").split()
+            try:
+                # Converted in C in one call; only malformed payloads take the per-token path
+                spectrumArray = numpy.array(tokens,dtype=numpy.float32) if tokens else None
+            except ValueError:
+                values = []
+                for token in tokens:
+                    try:
+                        values.append(float(token))
+                    except (TypeError,ValueError):
+                        continue
+                if values:
+                    spectrumArray = numpy.asarray(values,dtype=numpy.float32)
 
         return spectrumArray
 
+    @staticmethod
+    def _load_base_profile(value):
+        """
+        Converts the base intensity profile read from the configuration into a float32 array,
+        once at start-up. Returns None if it is missing, empty or not a list of numbers.
+        """
+        if value is None:
+            return None
+        try:
+            baseProfile = numpy.asarray(value,dtype=numpy.float32).ravel()
+        except (TypeError,ValueError):
+            return None
+        return baseProfile if baseProfile.size > 0 else None
+
     @staticmethod
     def _safe_float(value,default=None):
         """
@@ -474,10 +729,7 @@ class Analysis(Module):
 
         if baseArray.size == targetLength:
             return baseArray
-
-        xBase = numpy.linspace(0.0,1.0,num=baseArray.size,endpoint=True)
-        xTarget = numpy.linspace(0.0,1.0,num=targetLength,endpoint=True)
-        return numpy.interp(xTarget,xBase,baseArray)
+        return self._resample_spectrum(baseArray,targetLength)
 
     def _compute_processed_profile(self,intensityProfile):
         """
@@ -491,27 +743,29 @@ class Analysis(Module):
             return profile
 
         try:
-            baseArray = numpy.asarray(self.baseIntensityProfile,dtype=numpy.float32)
+            baseResampled = self._get_resampled_base_profile(profile.size)
         except Exception as exc:
-            self.log("WARNING",f"Failed to convert base intensity profile: {exc}")
-            return profile
-
-        if baseArray.size == 0:
+            self.log("WARNING",f"Failed to resample base intensity profile: {exc}")
             return profile
 
-        if baseArray.size != profile.size:
-            x_base = numpy.linspace(0.0,1.0,num=baseArray.size,endpoint=True)
-            x_target = numpy.linspace(0.0,1.0,num=profile.size,endpoint=True)
-            try:
-                baseResampled = numpy.interp(x_target,x_base,baseArray)
-            except Exception as exc:
-                self.log("WARNING",f"Failed to resample base intensity profile: {exc}")
-                return profile
-        else:
-            baseResampled = baseArray
-
         return baseResampled - profile
 
+    @staticmethod
+    @lru_cache(maxsize=32)
+    def _interpolation_weights(sourceLength,targetLength):
+        """
+        Returns, for each of the targetLength output samples, the indices of the two source
+        samples around it and the weight of the second one, so that linear resampling is two
+        gathers and a multiply-add. Built once per pair of lengths and shared read-only.
+        """
+        positions = numpy.linspace(0.0,sourceLength - 1,num=targetLength,endpoint=True)
+        lower = numpy.minimum(positions.astype(numpy.intp),sourceLength - 2)
+        upper = lower + 1
+        weights = (positions - lower).astype(numpy.float32)
+        for array in (lower,upper,weights):
+            array.setflags(write=False)
+        return lower,upper,weights
+
     @staticmethod
     def _resample_spectrum(spectrum,target_length):
         """
@@ -527,9 +781,13 @@ class Analysis(Module):
         if spectrumArray.size == 1:
             return numpy.full((target_length,),spectrumArray[0],dtype=numpy.float32)
 
-        x_source = numpy.linspace(0.0,1.0,num=spectrumArray.size,endpoint=True)
-        x_target = numpy.linspace(0.0,1.0,num=int(target_length),endpoint=True)
-        return numpy.interp(x_target,x_source,spectrumArray)
+        lower,upper,weights = Analysis._interpolation_weights(spectrumArray.size,int(target_length))
+        resampled = spectrumArray[upper]
+        lowerValues = spectrumArray[lower]
+        resampled -= lowerValues
+        resampled *= weights
+        resampled += lowerValues
+        return resampled
 
     @staticmethod
     def _normalize_profile(profile):
@@ -544,7 +802,10 @@ class Analysis(Module):
         amplitude = max_val - min_val
         if amplitude <= 0.0:
             return numpy.zeros_like(array)
-        return (array - min_val) / amplitude
+        # The subtraction allocates the result; scale it in place instead of allocating again
+        normalized = array - numpy.float32(min_val)
+        normalized /= numpy.float32(amplitude)
+        return normalized
 
     def detectAbsorbanceValleys(self,intensityProfile,processedProfile=None):
         """
@@ -590,71 +851,158 @@ class Analysis(Module):
         """
         Appends a full spectrum entry to the reference spectra CSV and updates the in-memory cache.
         """
-        fieldnames = [
-            "substance",
-            "ion_state",
-            "source",
-            "captured_at",
-            "pixel_to_nm_factor",
-            "pixel_to_nm_offset",
-            "spectrum_length",
-            "spectrum_values"
-        ]
+        spectrumArray = numpy.asarray(spectrum,dtype=numpy.float32)
+
+        # Everything that does not touch shared state is prepared before taking the lock
+        if self.referenceSpectraStorage == "npy":
+            serializedSpectrum = self._save_reference_array(spectrumArray,metadata.get("substance","Unknown"))
+        else:
+            serializedSpectrum = json.dumps(spectrumArray.tolist())
+        entry = {
+            "substance": metadata.get("substance","Unknown"),
+            "ion_state": metadata.get("ion_state",""),
+            "source": metadata.get("source",""),
+            "captured_at": metadata.get("captured_at",""),
+            "pixel_to_nm_factor": "" if metadata.get("pixel_to_nm_factor") is None else f"{float(metadata['pixel_to_nm_factor']):.6f}",
+            "pixel_to_nm_offset": "" if metadata.get("pixel_to_nm_offset") is None else f"{float(metadata['pixel_to_nm_offset']):.6f}",
+            "spectrum_length": str(int(spectrumArray.size)),
+            "spectrum_values": serializedSpectrum
+        }
+        reference = {
+            "substance"          : entry["substance"],
+            "ion_state"          : entry["ion_state"],
+            "source"             : entry["source"],
+            "captured_at"        : entry["captured_at"],
+            "pixel_to_nm_factor" : self._safe_float(metadata.get("pixel_to_nm_factor"),default=self.config.get("pixel_to_nm_factor")),
+            "pixel_to_nm_offset" : self._safe_float(metadata.get("pixel_to_nm_offset"),default=self.config.get("pixel_to_nm_offset")),
+            "spectrum"           : spectrumArray
+        }
+
+        with self._referenceLock:
+            writer = self._get_reference_writer()
+            writer.writerow(entry)
+            self._referenceFile.flush()
+
+            # Replaced rather than appended to, so a list read without the lock never changes underneath
+            self.referenceSpectra = (self.referenceSpectra or []) + [reference]
+            self._extend_aligned_references(reference)
+
+    def _save_reference_array(self,spectrumArray,substance):
+        """
+        Saves a reference spectrum as a .npy file in the 'spectra' directory next to the
+        reference CSV and returns its path relative to the CSV, to be stored in place of the values.
+        """
+        safeName = "".join(char if char.isalnum() or char in "-_" else "_" for char in str(substance)) or "reference"
+        relativePath = os.path.join("spectra",f"{safeName}_{time.time_ns()}.npy")
+        fullPath = os.path.join(os.path.dirname(self.referenceSpectraPath),relativePath)
+        os.makedirs(os.path.dirname(fullPath),exist_ok=True)
+        numpy.save(fullPath,spectrumArray)
+        return relativePath
+
+    def _get_reference_writer(self):
+        """
+        Returns the CSV writer appending to the reference spectra file. The file is opened,
+        and its header and trailing newline checked, only once; later captures reuse the handle.
+        From then on every row written ends with the writer's line terminator, so the end of
+        the file never needs to be probed again. Must be called with _referenceLock held.
+        """
+        if self._referenceWriter is not None:
+            return self._referenceWriter
+
         filePath = self.referenceSpectraPath
         directory = os.path.dirname(filePath)
         if directory:
             os.makedirs(directory,exist_ok=True)
 
+        # A single binary handle both probes the end of the file and, wrapped as text,
+        # appends the rows: writes in append mode always go to the end of the file
+        rawFile = open(filePath,"a+b")
+        needsHeader = rawFile.seek(0,os.SEEK_END) == 0
+        appendNewline = False
+        if not needsHeader:
+            rawFile.seek(-1,os.SEEK_END)
+            appendNewline = rawFile.read(1) not in (b"\n",b"\r")
+
+        csvFile = io.TextIOWrapper(rawFile,newline='')
+        if appendNewline:
+            csvFile.write("\n")
+        writer = csv.DictWriter(csvFile,fieldnames=self._REFERENCE_FIELDNAMES)
+        if needsHeader:
+            writer.writeheader()
+
+        self._referenceFile = csvFile
+        self._referenceWriter = writer
+        return writer
+
+    def _close_reference_file(self):
+        """
+        Closes the reference spectra file, if it was opened for appending.
+        """
         with self._referenceLock:
-            try:
-                needsHeader = not os.path.exists(filePath) or os.path.getsize(filePath) == 0
-            except OSError:
-                needsHeader = True
-
-            appendNewline = False
-            if not needsHeader:
+            if self._referenceFile is not None:
                 try:
-                    with open(filePath,"rb") as existingFile:
-                        existingFile.seek(0,os.SEEK_END)
-                        if existingFile.tell() > 0:
-                            existingFile.seek(-1,os.SEEK_END)
-                            lastByte = existingFile.read(1)
-                            appendNewline = lastByte not in (b"\n",b"\r")
+                    self._referenceFile.close()
                 except OSError:
-                    appendNewline = False
-
-            serializedSpectrum = json.dumps([float(value) for value in numpy.asarray(spectrum,dtype=numpy.float32)])
-            entry = {
-                "substance": metadata.get("substance","Unknown"),
-                "ion_state": metadata.get("ion_state",""),
-                "source": metadata.get("source",""),
-                "captured_at": metadata.get("captured_at",""),
-                "pixel_to_nm_factor": "" if metadata.get("pixel_to_nm_factor") is None else f"{float(metadata['pixel_to_nm_factor']):.6f}",
-                "pixel_to_nm_offset": "" if metadata.get("pixel_to_nm_offset") is None else f"{float(metadata['pixel_to_nm_offset']):.6f}",
-                "spectrum_length": str(int(len(spectrum))),
-                "spectrum_values": serializedSpectrum
-            }
+                    pass
+            self._referenceFile = None
+            self._referenceWriter = None
+
+    def _get_aligned_references(self,targetLength):
+        """
+        Returns the references together with a float64 matrix holding, one per row, their
+        spectra resampled to targetLength and normalized, and the squared norm of each row.
+        Each reference is prepared once per profile length and the result is cached until
+        the reference set changes.
+
+        The returned tuple is an immutable snapshot: callers can use it without holding
+        _referenceLock, which is only taken to build a missing entry.
+        """
+        aligned = self._alignedReferences.get(targetLength)
+        if aligned is not None:
+            return aligned
+
+        with self._referenceLock:
+            aligned = self._alignedReferences.get(targetLength)
+            if aligned is None:
+                references = []
+                rows = []
+                for reference in self.referenceSpectra or []:
+                    refSpectrum = reference.get("spectrum")
+                    if refSpectrum is None:
+                        continue
 
-            with open(filePath,"a",newline='') as csvFile:
-                if appendNewline:
-                    csvFile.write("\n")
-                writer = csv.DictWriter(csvFile,fieldnames=fieldnames)
-                if needsHeader:
-                    writer.writeheader()
-                writer.writerow(entry)
-
-            spectrumArray = numpy.asarray(spectrum,dtype=numpy.float32)
-            if self.referenceSpectra is None:
-                self.referenceSpectra = []
-            self.referenceSpectra.append({
-                "substance"          : entry["substance"],
-                "ion_state"          : entry["ion_state"],
-                "source"             : entry["source"],
-                "captured_at"        : entry["captured_at"],
-                "pixel_to_nm_factor" : self._safe_float(entry["pixel_to_nm_factor"],default=self.config.get("pixel_to_nm_factor")),
-                "pixel_to_nm_offset" : self._safe_float(entry["pixel_to_nm_offset"],default=self.config.get("pixel_to_nm_offset")),
-                "spectrum"           : spectrumArray
-            })
+                    alignedRef = self._resample_spectrum(refSpectrum,targetLength)
+                    if alignedRef.size == 0:
+                        continue
+
+                    references.append(reference)
+                    rows.append(self._normalize_profile(alignedRef))
+
+                if rows:
+                    refMatrix = numpy.vstack(rows).astype(numpy.float64)
+                else:
+                    refMatrix = numpy.empty((0,targetLength),dtype=numpy.float64)
+                aligned = (tuple(references),refMatrix,numpy.einsum("ij,ij->i",refMatrix,refMatrix))
+                self._alignedReferences[targetLength] = aligned
+        return aligned
+
+    def _extend_aligned_references(self,reference):
+        """
+        Adds a newly stored reference to every cached aligned matrix, so that
+        a capture does not force all references to be resampled again.
+        Must be called with _referenceLock held.
+        """
+        for targetLength,(references,refMatrix,refSquaredNorms) in list(self._alignedReferences.items()):
+            alignedRef = self._resample_spectrum(reference["spectrum"],targetLength)
+            if alignedRef.size == 0:
+                continue
+            row = self._normalize_profile(alignedRef).astype(numpy.float64)
+            # New objects are built so that analyses already holding the old tuple are unaffected
+            self._alignedReferences[targetLength] = (
+                references + (reference,),
+                numpy.vstack((refMatrix,row)),
+                numpy.append(refSquaredNorms,row @ row)
+            )
 
     def compareWithReferences(self,intensityProfile):
         """
@@ -666,6 +1014,7 @@ class Analysis(Module):
             
         Returns:
             dict: Risultati del confronto, inclusi migliori corrispondenze e stato dell'identificazione.
+                  Gli spettrogrammi sono restituiti come numpy.ndarray.
         """
         if self.referenceSpectra is None:
             raise RuntimeError("Reference data not loaded. Cannot perform comparison.")
@@ -675,39 +1024,45 @@ class Analysis(Module):
             raise ValueError("Captured intensity profile is empty.")
 
         capturedNormalized = self._normalize_profile(capturedArray)
-        capturedNorm = float(numpy.linalg.norm(capturedNormalized))
+        captured64 = capturedNormalized.astype(numpy.float64)
+        capturedSquaredNorm = float(captured64 @ captured64)
+        capturedNorm = float(numpy.sqrt(capturedSquaredNorm))
 
         matches = []
 
-        for reference in self.referenceSpectra:
-            refSpectrum = reference.get("spectrum")
-            if refSpectrum is None:
-                continue
-
-            alignedRef = self._resample_spectrum(refSpectrum,capturedArray.size)
-            if alignedRef.size == 0:
-                continue
-
-            refNormalized = self._normalize_profile(alignedRef)
-            diff = capturedNormalized - refNormalized
-            rmse = float(numpy.sqrt(numpy.mean(numpy.square(diff))))
-
-            if capturedNorm > 0.0:
-                relativeError = float(numpy.linalg.norm(diff) / capturedNorm)
-            else:
-                relativeError = float(numpy.linalg.norm(diff))
-
-            matches.append({
-                "substance": reference.get("substance","Unknown"),
-                "ion_state": reference.get("ion_state",""),
-                "source": reference.get("source",""),
-                "captured_at": reference.get("captured_at",""),
-                "rmse": rmse,
-                "relative_error": relativeError,
-                "within_tolerance": relativeError <= self.profileMatchTolerance
-            })
-
-        matches.sort(key=lambda item: item["relative_error"])
+        references,refMatrix,refSquaredNorms = self._get_aligned_references(capturedArray.size)
+        if references:
+            # |c - r|^2 = |c|^2 + |r|^2 - 2 r.c: one matrix-vector product against every reference
+            # replaces the difference matrix; the cached |r|^2 and float64 keep it exact enough
+            squaredErrors = refMatrix @ captured64
+            squaredErrors *= -2.0
+            squaredErrors += refSquaredNorms
+            squaredErrors += capturedSquaredNorm
+            numpy.maximum(squaredErrors,0.0,out=squaredErrors)
+            errorNorms = numpy.sqrt(squaredErrors)
+            rmseValues = errorNorms / numpy.sqrt(capturedArray.size)
+            relativeErrors = errorNorms / capturedNorm if capturedNorm > 0.0 else errorNorms
+            withinTolerance = relativeErrors <= self.profileMatchTolerance
+
+            # Order by relative error on the arrays, then build every match record in one pass
+            order = numpy.argsort(relativeErrors,kind="stable")
+            matches = [
+                {
+                    "substance": references[index].get("substance","Unknown"),
+                    "ion_state": references[index].get("ion_state",""),
+                    "source": references[index].get("source",""),
+                    "captured_at": references[index].get("captured_at",""),
+                    "rmse": rmse,
+                    "relative_error": relativeError,
+                    "within_tolerance": within
+                }
+                for index,rmse,relativeError,within in zip(
+                    order.tolist(),
+                    rmseValues[order].tolist(),
+                    relativeErrors[order].tolist(),
+                    withinTolerance[order].tolist()
+                )
+            ]
 
         identified = []
         best_match = matches[0] if matches else None
@@ -718,9 +1073,9 @@ class Analysis(Module):
 
         return {
             "detected_peaks": [],
-            "raw_spectrogram": capturedArray.tolist(),
+            "raw_spectrogram": capturedArray,
             "processed_spectrogram": [],
-            "normalized_spectrogram": capturedNormalized.tolist(),
+            "normalized_spectrogram": capturedNormalized,
             "reference_matches": matches,
             "identified_substances": identified,
             "best_match": best_match,
@@ -728,6 +1083,16 @@ class Analysis(Module):
             "match_within_tolerance": match_within_tolerance
         }
 
+    def _encode_spectrogram(self,values):
+        """
+        Serializes a spectrogram for the AnalysisComplete message: a list of floats,
+        or the Base64 encoded float32 samples when binary payloads are enabled.
+        """
+        valuesArray = numpy.asarray(values,dtype=numpy.float32)
+        if self.binarySpectrogramPayload:
+            return base64.b64encode(valuesArray.tobytes()).decode("ascii")
+        return valuesArray.tolist()
+
     def sendAnalysisResults(self,results):
         """
         Sends the final analysis results message.
@@ -735,16 +1100,29 @@ class Analysis(Module):
         Args:
             results (dict): The dictionary of analysis results.
         """
+        # The spectrogram arrays are already sent at the top level: keep them out of
+        # the details so they are not serialized twice
+        details = {key: value for key, value in results.items() if key not in self._SPECTROGRAM_KEYS}
         payload = {
             "identified_substances": results.get("identified_substances", []),
-            "spectrogram_data": results.get("raw_spectrogram", []),
-            "processed_spectrogram": results.get("processed_spectrogram", []),
-            "normalized_spectrogram": results.get("normalized_spectrogram", []),
+            "spectrogram_encoding": "float32_base64" if self.binarySpectrogramPayload else "list",
+            "spectrogram_data": self._encode_spectrogram(results.get("raw_spectrogram", [])),
+            "processed_spectrogram": self._encode_spectrogram(results.get("processed_spectrogram", [])),
+            "normalized_spectrogram": self._encode_spectrogram(results.get("normalized_spectrogram", [])),
             "reference_matches": results.get("reference_matches", []),
             "best_match": results.get("best_match"),
             "match_within_tolerance": results.get("match_within_tolerance", False),
             "match_tolerance": results.get("tolerance", self.profileMatchTolerance),
-            "details": results
+            "details": details
         }
         self.sendMessage("All","AnalysisComplete",payload)
         self.log("INFO","Analysis complete and results sent.")
+
+    def onStop(self):
+        """
+        Waits for pending analyses, then releases the shared frame segment
+        and the reference spectra file when the module terminates.
+        """
+        self._workerPool.shutdown(wait=True)
+        self._release_frame_segment()
+        self._close_reference_file()
@@ -9,8 +9,11 @@ import time
 import cv2
 import base64
 import json
-from picamera2 import Picamera2
-from threading import Thread, Event, Lock
+import os
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
+from picamera2 import Picamera2, MappedArray
+from threading import Event, Lock
 from module    import Module
 from configLoader import ConfigLoader
 
@@ -19,6 +22,14 @@ class Camera(Module):
     Manages the PiCamera.
     Inherits from the base Module class.
     """
+    # Fixed calibration candidates, built once per process
+    _EXPOSURE_LEVELS   = tuple(microseconds * 1000 for microseconds in range(10,105,10)) # in microseconds
+    _COLOR_LEVELS      = tuple(range(15,260,10))
+    _LED_BRIGHTNESS    = tuple(range(25,260,10)) # values from 0-255
+    # Shared frames are preceded by a header holding the sequence number of the frame
+    # currently in the segment; 64 bytes keeps the pixel data cache-line aligned
+    _FRAME_HEADER_BYTES = 64
+
     def __init__(self,moduleConfig,networkConfig,systemConfig):
         super().__init__("Camera",networkConfig,systemConfig)
         if moduleConfig is None:
@@ -26,6 +37,7 @@ class Camera(Module):
             moduleConfig = full_config.get("modules", {}).get("camera", {})
 
         self.config    = moduleConfig or {}
+        self._config_path = (systemConfig or {}).get("config_path", "config.json")
         resolution_cfg = self.config.get('resolution', (1920, 1080))
         if isinstance(resolution_cfg, (list, tuple)) and len(resolution_cfg) == 2:
             self.resolution = (int(resolution_cfg[0]), int(resolution_cfg[1]))
@@ -35,6 +47,16 @@ class Camera(Module):
         self.exposure    = int(self._safe_float(self.config.get('exposure', 10000), fallback=10000))
         self.awb_gains   = self._parse_awb_gains(self.config.get('awb_gains'))
         self.camera      = None
+        self.share_frames = bool(self.config.get('shared_memory_frames', True))
+        self.jpeg_quality = int(min(100, max(1, self._safe_float(self.config.get('jpeg_quality', 95), fallback=95))))
+        # Calibration metrics are scored on a frame downscaled by this factor (1 keeps full resolution)
+        calibration_scale = self._safe_float(self.config.get('calibration_scale', 0.25), fallback=0.25)
+        self.calibration_scale = calibration_scale if 0 < calibration_scale <= 1 else 1.0
+        # Calibration frames whose mean gray level falls outside this range are rejected unscored
+        self.calibration_min_brightness = self._safe_float(self.config.get('calibration_min_brightness', 10), fallback=10.0)
+        self.calibration_max_brightness = self._safe_float(self.config.get('calibration_max_brightness', 245), fallback=245.0)
+        # OpenCL scoring only pays off where OpenCV actually has a device to dispatch to
+        self.opencl_scoring = bool(self.config.get('calibration_opencl', False)) and cv2.ocl.haveOpenCL()
 
         self.light_on_timeout   = self._get_duration('light_on_timeout_s', default=2.0)
         self.light_settle_time  = self._get_duration('light_settle_time_s', default=0.05)
@@ -42,7 +64,12 @@ class Camera(Module):
 
         self._light_ready_event     = Event()
         self._capture_lock          = Lock()
+        self._capture_pool          = ThreadPoolExecutor(max_workers=1,thread_name_prefix="capture")
         self._manual_mode_configured = False
+        self._frame_buffer          = None
+        self._frame_sequence        = 0
+        self._applied_controls      = {}
+        self._calibration_light     = (None, None)
 
 
     def _safe_float(self, value, fallback):
@@ -106,36 +133,46 @@ class Camera(Module):
 
         if msgType == "CuvettePresent":
             self.log("INFO","Received 'Cuvette Present' signal. Taking a picture.")
-            self._schedule_picture_capture("Analysis","Analyze","Picture taken and sent for analysis.")
+            self._schedule_picture_capture("Analysis","Analyze","Picture taken and sent for analysis.",shared=self.share_frames)
         elif msgType == "Take":
             self.log("INFO","Received 'Take' command. Taking a picture.")
             self._schedule_picture_capture("All","PictureTaken","Picture taken and sent to anyone listening.")
         elif msgType == "Analyze":
             self.log("INFO","Received 'Analyze' command. Starting analysis.")
-            self._schedule_picture_capture("Analysis","Analyze","Picture taken and sent for analysis.")
+            # Analysis asks for a JPEG when it could not read a shared frame
+            payload = message.get("Message",{}).get("payload") or {}
+            if payload.get("shared_unreachable") and self.share_frames:
+                self.share_frames = False
+                self.log("WARNING","Analysis cannot attach shared memory frames; sending JPEG frames from now on.")
+            shared = self.share_frames and payload.get("shared",True)
+            self._schedule_picture_capture("Analysis","Analyze","Picture taken and sent for analysis.",shared=bool(shared))
         elif msgType == "Calibrate":
             self.log("INFO","Received 'Calibrate' command. Starting calibration.")
             self.calibrate()
 
-    def _schedule_picture_capture(self,destination,msg_type,success_log,failure_log="Failed to take a picture."):
+    def _schedule_picture_capture(self,destination,msg_type,success_log,failure_log="Failed to take a picture.",shared=False):
         """
-        Launches an asynchronous capture workflow so the main loop can keep
+        Queues an asynchronous capture workflow so the main loop can keep
         processing messages (e.g., waiting for the LED to confirm it is on).
+        Captures run one at a time on a single reusable worker thread.
         """
         def worker():
-            picture = self.takePicture()
+            picture = self.takePicture(shared=shared)
             if picture:
                 self.sendMessage(destination,msg_type,picture)
                 self.log("INFO",success_log)
             else:
                 self.log("ERROR",failure_log)
 
-        capture_thread = Thread(target=worker,daemon=True)
-        capture_thread.start()
+        self._capture_pool.submit(worker)
 
-    def takePicture(self):
+    def takePicture(self, shared=False):
         """
         Takes a picture and sends it to the Analysis module.
+
+        Args:
+            shared (bool): If True, the raw frame is published through shared memory
+                           instead of being JPEG and Base64 encoded.
         """
         if not self.camera:
             self.log("ERROR","Cannot take picture,camera not initialized.")
@@ -174,8 +211,18 @@ class Camera(Module):
         if frame is None:
             return None
 
+        if shared:
+            try:
+                with self._capture_lock:
+                    payload = self._share_frame(frame)
+            except Exception as exc:
+                self.log("WARNING",f"Failed to share frame through shared memory, sending JPEG instead: {exc}")
+            else:
+                self.log("INFO","Picture taken")
+                return payload
+
         try:
-            success, buffer = cv2.imencode('.jpg', frame)
+            success, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
         except cv2.error as exc:
             self.log("ERROR",f"Failed to encode image: {exc}")
             return None
@@ -184,11 +231,53 @@ class Camera(Module):
             self.log("ERROR","Failed to encode image: imencode returned unsuccessful status.")
             return None
 
-        imageB64 = base64.b64encode(buffer).decode('utf-8')
+        imageB64 = base64.b64encode(buffer).decode('ascii')
         payload = {"image": imageB64}
         self.log("INFO","Picture taken")
         return payload
 
+    def _share_frame(self, frame):
+        """
+        Copies a raw frame into the shared memory segment owned by the camera and
+        returns the payload that lets a local module map it without any decoding.
+        The segment is reused across captures and only grows when a frame does not fit.
+        The header is cleared while the frame is rewritten and then set to the new
+        sequence number, so a reader can tell when its frame has been overwritten.
+        """
+        frame = numpy.ascontiguousarray(frame)
+        size = self._FRAME_HEADER_BYTES + frame.nbytes
+        if self._frame_buffer is None or self._frame_buffer.size < size:
+            self._release_frame_buffer()
+            self._frame_buffer = shared_memory.SharedMemory(create=True, size=size)
+
+        self._frame_sequence += 1
+        header = numpy.ndarray((1,), dtype=numpy.uint64, buffer=self._frame_buffer.buf)
+        shared_frame = numpy.ndarray(frame.shape, dtype=frame.dtype, buffer=self._frame_buffer.buf, offset=self._FRAME_HEADER_BYTES)
+        header[0] = 0
+        shared_frame[...] = frame
+        header[0] = self._frame_sequence
+        del header, shared_frame
+
+        return {
+            "frame": {
+                "shm": self._frame_buffer.name,
+                "shape": list(frame.shape),
+                "dtype": str(frame.dtype),
+                "offset": self._FRAME_HEADER_BYTES,
+                "sequence": self._frame_sequence
+            }
+        }
+
+    def _release_frame_buffer(self):
+        if self._frame_buffer is None:
+            return
+        try:
+            self._frame_buffer.close()
+            self._frame_buffer.unlink()
+        except Exception:
+            pass
+        self._frame_buffer = None
+
     def _ensure_manual_mode(self, force=False):
         if not self.camera:
             return
@@ -204,6 +293,8 @@ class Camera(Module):
         except Exception as exc:
             self.log("WARNING",f"Failed to disable camera auto controls: {exc}")
 
+        # Forced: apply every control again even if it was already set
+        self._applied_controls = {}
         self._apply_camera_controls(self.gain, self.exposure, self.awb_gains)
         self._manual_mode_configured = True
 
@@ -219,6 +310,8 @@ class Camera(Module):
         if awb_gains:
             controls["ColourGains"] = (float(awb_gains[0]), float(awb_gains[1]))
 
+        # Only controls that changed are sent, and the camera is only left to settle if any did
+        controls = {name: value for name, value in controls.items() if self._applied_controls.get(name) != value}
         if not controls:
             return
 
@@ -227,6 +320,7 @@ class Camera(Module):
         except Exception as exc:
             self.log("WARNING",f"Failed to apply manual camera controls: {exc}")
             return
+        self._applied_controls.update(controls)
 
         self._wait_for_camera_settle()
 
@@ -244,12 +338,72 @@ class Camera(Module):
         if self.control_settle_time > 0:
             time.sleep(self.control_settle_time)
 
+    def _score_settings(self, gain, exposure, r, g, b, brightness):
+        """
+        Applies one combination of camera and LED settings, captures a frame and
+        returns its combined image quality score.
+        """
+        # 1. Set camera and LED parameters; unchanged settings are not sent again
+        self._apply_camera_controls(gain, exposure, self.awb_gains)
+        if ((r, g, b), brightness) != self._calibration_light:
+            self.sendMessage("LightSource", "SetColorAndBrightness", {"r": r, "g": g, "b": b, "brightness": brightness})
+            self._calibration_light = ((r, g, b), brightness)
+            time.sleep(max(0.001, self.light_settle_time)) # Wait for the LED to update
+
+        # 2. Capture the image and score it straight from the camera buffer, without a per-trial copy
+        request = self.camera.capture_request()
+        try:
+            with MappedArray(request, "main") as mapped:
+                total_score = self._score_frame(mapped.array)
+        finally:
+            request.release()
+
+        return float(total_score)
+
+    def _score_frame(self, image_array):
+        """
+        Returns the combined image quality score of a BGR frame: the sum of its
+        sharpness (mean gradient magnitude), contrast (standard deviation of the
+        gray levels) and visible color band (average HSV saturation).
+        Frames that are too dark or clipped score 0 without computing the metrics.
+        """
+        # Sharpness, contrast and saturation rank settings just as well on a smaller frame
+        if self.calibration_scale < 1:
+            image_array = cv2.resize(image_array, None, fx=self.calibration_scale, fy=self.calibration_scale, interpolation=cv2.INTER_AREA)
+        if self.opencl_scoring:
+            image_array = cv2.UMat(image_array)
+
+        # Grayscale and HSV are each converted once and every metric reads them in place
+        gray_image = cv2.cvtColor(image_array, cv2.COLOR_BGR2GRAY)
+
+        # Contrast (Standard Deviation), computed by OpenCV in a single pass with the mean
+        # brightness, which rejects under- and overexposed frames before the costlier metrics
+        mean, stddev = cv2.meanStdDev(gray_image)
+        if self.opencl_scoring:
+            mean, stddev = mean.get(), stddev.get()
+        if not self.calibration_min_brightness <= mean[0, 0] <= self.calibration_max_brightness:
+            return 0.0
+        contrast = stddev[0, 0]
+
+        hsv_image = cv2.cvtColor(image_array, cv2.COLOR_BGR2HSV)
+
+        # Sharpness (Gradient); float32 halves the memory traffic of the float64 derivatives
+        sobelx = cv2.Sobel(gray_image, cv2.CV_32F, 1, 0, ksize=5)
+        sobely = cv2.Sobel(gray_image, cv2.CV_32F, 0, 1, ksize=5)
+        # The magnitude overwrites sobelx in place, so no temporaries are allocated for it
+        gradient = cv2.mean(cv2.magnitude(sobelx, sobely, sobelx))[0]
+
+        # Visible Color Band (Average Saturation), the mean of the HSV channel 1
+        avg_saturation = cv2.mean(hsv_image)[1]
+
+        # A simple sum is used, but weights could be added for more specific optimization.
+        return float(gradient + contrast + avg_saturation)
+
     def calibrate(self):
         """
-        Performs a comprehensive automated calibration by iterating through various
-        combinations of camera and RGB LED settings to find the optimal set that
-        maximizes image quality, as measured by sharpness, contrast, and visible
-        color spectrum.
+        Performs an automated calibration by searching the combinations of camera
+        and RGB LED settings for the set that maximizes image quality, as measured
+        by sharpness, contrast, and visible color spectrum.
 
         The process involves:
         1. Setting camera parameters (ISO, exposure).
@@ -258,7 +412,11 @@ class Camera(Module):
            - Sharpness (using image gradient).
            - Contrast (using standard deviation).
            - Visible color band (using average saturation from the HSV color space).
-        4. Storing the settings with the highest combined score.
+        4. Searching the settings coarse-to-fine: starting from the middle of every
+           range, each setting is moved up and down by a coarse step while the others
+           are kept, the best combination is kept, and the step is halved when no move
+           improves the score. This takes a few hundred captures at most
+           ('calibration_max_trials') instead of the full Cartesian product.
         5. Applying the optimal settings to both the camera and the LightSource module.
         """
         if not self.camera:
@@ -279,72 +437,57 @@ class Camera(Module):
             self.log("ERROR", f"Could not get AnalogueGain range: {e}. Using default list.")
             gain_min, gain_max = 1.0, 16.0 # Fallback to a safe range
 
-        def makeColorsList():
-            from itertools import product
-            return list(product(range(15,260,10), range(15,260,10), range(15,260,10)))
-
-        # Placeholder lists for camera and LED settings
-        gain_list           = numpy.arange(gain_min, gain_max, 0.2)
-        exposure_list       = [microseconds * 1000 for microseconds in range(10,105,10)] # in microseconds
-        rgb_colors_list     = makeColorsList()
-        led_brightness_list = [light for light in range(25,260,10)] # values from 0-255
-
-        best_settings = {
-            "camera": {"gain": None, "exposure": None},
-            "light":  {"r": None, "g": None, "b": None, "brightness": None},
-            "score": 0
-        }
+        # Candidate values for camera and LED settings, in search order
+        gain_list           = [float(gain) for gain in numpy.arange(gain_min, gain_max, 0.2)] or [float(gain_min)]
+        color_levels = self._COLOR_LEVELS
+        search_space = (gain_list, self._EXPOSURE_LEVELS, color_levels, color_levels, color_levels, self._LED_BRIGHTNESS)
+        max_trials = max(1, int(self._safe_float(self.config.get('calibration_max_trials', 200), fallback=200)))
 
         try:
-            # Iterate through all combinations of camera and LED settings
-            for gain in gain_list:
-                for exposure in exposure_list:
-                    for r, g, b in rgb_colors_list:
-                        for brightness in led_brightness_list:
-                            # 1. Set camera and LED parameters
-                            self._apply_camera_controls(gain, exposure, self.awb_gains)
-                            self.sendMessage("LightSource", "SetColor", {"r": r, "g": g, "b": b})
-                            self.sendMessage("LightSource", "Dim", {"brightness": brightness})
-                            time.sleep(max(0.001, self.light_settle_time)) # Wait for the LED to update
-                            
-                            # 2. Capture the image
-                            image_array = self.camera.capture_array("main")
-                            
-                            # 3. Convert to grayscale and HSV for metric calculation
-                            gray_image = cv2.cvtColor(image_array, cv2.COLOR_BGR2GRAY)
-                            hsv_image = cv2.cvtColor(image_array, cv2.COLOR_BGR2HSV)
-
-                            # 4. Calculate metrics
-                            # Sharpness (Gradient)
-                            sobelx = cv2.Sobel(gray_image, cv2.CV_64F, 1, 0, ksize=5)
-                            sobely = cv2.Sobel(gray_image, cv2.CV_64F, 0, 1, ksize=5)
-                            gradient = numpy.sqrt(sobelx**2 + sobely**2).mean()
-
-                            # Contrast (Standard Deviation)
-                            contrast = numpy.std(gray_image)
-
-                            # Visible Color Band (Average Saturation)
-                            # We get the saturation channel (index 1) from the HSV image
-                            saturation = hsv_image[:, :, 1]
-                            avg_saturation = numpy.mean(saturation)
-
-                            # 5. Calculate combined score
-                            # A simple sum is used, but weights could be added for more specific optimization.
-                            total_score = gradient + contrast + avg_saturation
-                            self.log("DEBUG", f"Testing settings: Gain={gain:.2f}, Exposure={exposure}, RGB={r,g,b}, Brightness={brightness}, Score={total_score}")
-                            
-                            # 6. Update the best settings
-                            if total_score > best_settings["score"]:
-                                best_settings["camera"]["gain"]      = float(gain)
-                                best_settings["camera"]["exposure"]  = int(exposure)
-                                best_settings["light"]["r"]          = int(r)
-                                best_settings["light"]["g"]          = int(g)
-                                best_settings["light"]["b"]          = int(b)
-                                best_settings["light"]["brightness"] = int(brightness)
-                                best_settings["score"]               = float(total_score)
-
-            # 7. Apply the best settings found
-            if best_settings["camera"]["gain"]:
+            # Scores by index combination, so that no combination is captured twice
+            scores = {}
+            self._calibration_light = (None, None)
+
+            def evaluate(indices):
+                if indices not in scores:
+                    scores[indices] = self._score_settings(*(values[i] for values, i in zip(search_space, indices)))
+                return scores[indices]
+
+            current    = tuple(len(values) // 2 for values in search_space)
+            best_score = evaluate(current)
+            steps      = [max(1, len(values) // 4) for values in search_space]
+
+            while len(scores) < max_trials:
+                improved = False
+                for dim, values in enumerate(search_space):
+                    for direction in (-1, 1):
+                        index = min(len(values) - 1, max(0, current[dim] + direction * steps[dim]))
+                        if index == current[dim] or len(scores) >= max_trials:
+                            continue
+                        candidate = current[:dim] + (index,) + current[dim + 1:]
+                        score = evaluate(candidate)
+                        if score > best_score:
+                            best_score, current, improved = score, candidate, True
+                if not improved:
+                    if all(step == 1 for step in steps):
+                        break
+                    steps = [max(1, step // 2) for step in steps]
+
+            self.log("INFO", f"Calibration search finished after {len(scores)} captures.")
+            # One summary of the best trials instead of a log message per capture
+            for indices, score in sorted(scores.items(), key=lambda item: item[1], reverse=True)[:5]:
+                gain, exposure, r, g, b, brightness = (values[i] for values, i in zip(search_space, indices))
+                self.log("DEBUG", f"Top settings: Gain={gain:.2f}, Exposure={exposure}, RGB={r,g,b}, Brightness={brightness}, Score={score}")
+
+            # 7. Apply the best settings found; rejected or empty frames all score 0
+            if best_score > 0:
+                gain, exposure, r, g, b, brightness = (values[i] for values, i in zip(search_space, current))
+                best_settings = {
+                    "camera": {"gain": float(gain), "exposure": int(exposure)},
+                    "light":  {"r": int(r), "g": int(g), "b": int(b), "brightness": int(brightness)},
+                    "score": float(best_score)
+                }
+
                 # Set best camera settings
                 self._apply_camera_controls(
                     best_settings["camera"]["gain"],
@@ -352,12 +495,7 @@ class Camera(Module):
                     self.awb_gains
                 )
                 # Set best light settings
-                self.sendMessage("LightSource", "SetColor", {
-                    "r": best_settings["light"]["r"],
-                    "g": best_settings["light"]["g"],
-                    "b": best_settings["light"]["b"]
-                })
-                self.sendMessage("LightSource", "Dim", {"brightness": best_settings["light"]["brightness"]})
+                self.sendMessage("LightSource", "SetColorAndBrightness", dict(best_settings["light"]))
 
                 # Update config in memory
                 self.config.update(best_settings)
@@ -366,17 +504,22 @@ class Camera(Module):
                 self._manual_mode_configured = False
                 self._ensure_manual_mode(force=True)
 
-                # Save config to file
+                # Save config to file; the new file replaces the old one atomically
+                # so a crash cannot leave it truncated
+                tmp_path = f"{self._config_path}.tmp"
                 try:
-                    with open('config.json', 'r+') as f:
+                    with open(self._config_path, 'r') as f:
                         data = json.load(f)
-                        data['modules']['camera'].update(best_settings)
-                        f.seek(0)
-                        json.dump(data, f, indent=2)
-                        f.truncate()
-                    self.log("INFO", "Calibration settings saved to config.json.")
+                    data['modules']['camera'].update(best_settings)
+                    serialized = json.dumps(data, indent=2)
+                    with open(tmp_path, 'w') as f:
+                        f.write(serialized)
+                    os.replace(tmp_path, self._config_path)
+                    self.log("INFO", f"Calibration settings saved to {self._config_path}.")
                 except (IOError, json.JSONDecodeError) as e:
-                    self.log("ERROR", f"Could not save calibration settings to config.json: {e}")
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                    self.log("ERROR", f"Could not save calibration settings to {self._config_path}: {e}")
 
                 self.log("INFO", f"Calibration complete. Best settings found: {best_settings}")
                 self.sendMessage("All", "CameraCalibrated", {"status": "success", "settings": best_settings})
@@ -392,6 +535,8 @@ class Camera(Module):
         """
         Stops the camera when the module is terminated.
         """
+        self._capture_pool.shutdown(wait=False,cancel_futures=True)
         if self.camera and self.camera.started:
             self.camera.stop()
             self.log("INFO","Camera stopped.")
+        self._release_frame_buffer()
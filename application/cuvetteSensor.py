@@ -4,9 +4,8 @@ CC BY-SA 4.0
 https://creativecommons.org/licenses/by-sa/4.0/
 """
 
-import time
 from threading    import Thread
-from gpiozero     import InputDevice,GPIOZeroError
+from gpiozero     import DigitalInputDevice,GPIOZeroError
 
 from module       import Module
 from configLoader import ConfigLoader
@@ -30,6 +29,18 @@ class CuvetteSensor(Module):
             self.pollInterval   = float(pollInterval)
         except (TypeError,ValueError):
             self.pollInterval   = 1.0
+        # Ceiling the fallback poll backs off to while the sensor is stable; defaults to no back-off
+        maxPollInterval         = self.config.get('poll_interval_max_s', self.pollInterval)
+        try:
+            self.maxPollInterval = max(self.pollInterval, float(maxPollInterval))
+        except (TypeError,ValueError):
+            self.maxPollInterval = self.pollInterval
+        self.edgeDetection      = bool(self.config.get('edge_detection', True))
+        bounceTime              = self.config.get('bounce_time_s')
+        try:
+            self.bounceTime     = float(bounceTime) if bounceTime is not None else None
+        except (TypeError,ValueError):
+            self.bounceTime     = None
         self.isPresent          = False
         self.mode               = "Analysis"
         self.sensor             = None
@@ -37,7 +48,8 @@ class CuvetteSensor(Module):
 
     def onStart(self):
         """
-        Initializes the sensor monitoring thread.
+        Initializes the sensor. Presence changes are reported by gpiozero edge
+        callbacks; a polling thread is only used when 'edge_detection' is disabled.
         """
         self.sendMessage("EventManager", "Register")
 
@@ -46,7 +58,7 @@ class CuvetteSensor(Module):
             return
 
         try:
-            self.sensor = InputDevice(self.inputPin)
+            self.sensor = DigitalInputDevice(self.inputPin,bounce_time=self.bounceTime)
             self.log("INFO",f"Cuvette sensor initialized on pin {self.inputPin}.")
         except (GPIOZeroError,ValueError,RuntimeError) as exc:
             self.log("ERROR",f"Failed to initialize CuvetteSensor on pin {self.inputPin}: {exc}")
@@ -54,6 +66,12 @@ class CuvetteSensor(Module):
             return
 
         self.isPresent = bool(self.sensor.is_active)
+        if self.edgeDetection:
+            # The sensor reads inactive while the cuvette is in place
+            self.sensor.when_deactivated = self._on_presence_detected
+            self.sensor.when_activated   = self._on_presence_lost
+            return
+
         self._presence_thread = Thread(target=self._presence_loop,daemon=True)
         self._presence_thread.start()
 
@@ -63,7 +81,9 @@ class CuvetteSensor(Module):
 
         previous_active = bool(self.sensor.is_active)
         self.isPresent = previous_active
-        poll_interval = self.pollInterval if self.pollInterval > 0 else 0.01
+        min_interval  = self.pollInterval if self.pollInterval > 0 else 0.01
+        max_interval  = max(min_interval, self.maxPollInterval)
+        poll_interval = min_interval
 
         try:
             while not self.stopEvent.is_set():
@@ -71,7 +91,11 @@ class CuvetteSensor(Module):
                 if current_active != previous_active:
                     self._handle_presence_transition(previous_active,current_active)
                     previous_active = current_active
-                time.sleep(poll_interval)
+                    poll_interval = min_interval
+                else:
+                    # Back off while the cuvette stays put; any transition restores the fast rate
+                    poll_interval = min(max_interval, poll_interval * 1.5)
+                self.stopEvent.wait(poll_interval)
         except Exception as exc:
             self.log("ERROR",f"Presence loop error: {exc}")
         finally:
@@ -119,7 +143,7 @@ class CuvetteSensor(Module):
 
     def onStop(self):
         """
-        Ensures the presence monitoring thread is terminated cleanly.
+        Ensures the presence callbacks and monitoring thread are terminated cleanly.
         """
         self.stopEvent.set()
 
@@ -129,6 +153,8 @@ class CuvetteSensor(Module):
 
         if self.sensor is not None:
             try:
+                self.sensor.when_activated   = None
+                self.sensor.when_deactivated = None
                 self.sensor.close()
             except Exception:
                 pass
@@ -5,15 +5,15 @@ https://creativecommons.org/licenses/by-sa/4.0/
 """
 
 import base64
-from io import BytesIO
-from threading import Thread
+from threading import Lock, Thread
 from typing import Optional
 
+import cv2
 import numpy
 from kivy.app import App
 from kivy.clock import Clock
-from kivy.core.image import Image as CoreImage
 from kivy.logger import Logger
+from kivy.graphics.texture import Texture
 from kivy.properties import ObjectProperty
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.label import Label
@@ -47,6 +47,11 @@ class _PassiveFigureCanvas(FigureCanvasKivyAgg):
     def new_timer(self, *args, **kwargs):
         return _PassiveTimer(*args, **kwargs)
 
+    def draw(self, *args, **kwargs):
+        # A blit() only records blitbox for the next draw; a leftover one would crop full renders
+        self.blitbox = None
+        return super().draw(*args, **kwargs)
+
 
 class SpectrogramGraph(BoxLayout):
     """Widget that renders spectrogram data using Matplotlib."""
@@ -131,21 +136,26 @@ class SpectrogramGraph(BoxLayout):
             self._axes.set_xticks(numpy.linspace(max_thz, min_thz, num=5))
 
     def update_data(self, values) -> None:
-        self._axes.clear()
         if values is None:
             self._draw_placeholder()
             return
+        # Kept as one float array end to end; float32 payloads are plotted without boxing every sample
         try:
-            data = list(values)
-        except TypeError:
-            Logger.warning("GUI: spectrogram data is not iterable")
+            data = numpy.asarray(values, dtype=float)
+        except (TypeError, ValueError):
+            Logger.warning("GUI: spectrogram data is not a numeric sequence")
             self._draw_placeholder()
             return
-        if not data:
+        if data.ndim != 1:
+            Logger.warning("GUI: spectrogram data is not one-dimensional")
             self._draw_placeholder()
             return
+        if not data.size:
+            self._draw_placeholder()
+            return
+        self._axes.clear()
         try:
-            freq_axis = self._compute_frequency_axis(len(data))
+            freq_axis = self._compute_frequency_axis(data.size)
             self._axes.plot(freq_axis, data, color="#1f77b4", linewidth=1.5)
             self._configure_axes()
             self._apply_frequency_ticks(freq_axis)
@@ -176,7 +186,7 @@ class MainLayout(BoxLayout):
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        self._core_image_ref: Optional[CoreImage] = None
+        self._image_texture: Optional[Texture] = None
 
     def on_kv_post(self, base_widget):
         super().on_kv_post(base_widget)
@@ -204,23 +214,31 @@ class MainLayout(BoxLayout):
             if self.cli_scroll is None:
                 self.cli_scroll = pane_ids.get("cli_scroll")
 
-    def set_image_from_bytes(self, image_bytes: bytes) -> None:
-        """Decode JPEG bytes and update the image texture."""
+    def set_image_from_frame(self, frame) -> None:
+        """Upload a decoded BGR frame to the image texture."""
         self._ensure_references()
         if self.camera_image is None:
             return
-        if not image_bytes:
+        if frame is None or not frame.size:
             self.camera_image.texture = None
-            self._core_image_ref = None
+            self._image_texture = None
             return
+        height, width = frame.shape[:2]
+        texture = self._image_texture
+        # The texture is reused while the frame size does not change
+        if texture is None or texture.size != (width, height):
+            texture = Texture.create(size=(width, height), colorfmt="bgr")
+            texture.flip_vertical()
+            self._image_texture = texture
         try:
-            data_stream = BytesIO(image_bytes)
-            core_image = CoreImage(data_stream, ext="jpg")
+            texture.blit_buffer(numpy.ascontiguousarray(frame), colorfmt="bgr", bufferfmt="ubyte")
         except Exception as exc:  # pragma: no cover
-            Logger.warning(f"GUI: unable to load image bytes: {exc}")
+            Logger.warning(f"GUI: unable to load image frame: {exc}")
             return
-        self._core_image_ref = core_image
-        self.camera_image.texture = core_image.texture
+        if self.camera_image.texture is texture:
+            self.camera_image.canvas.ask_update()
+        else:
+            self.camera_image.texture = texture
 
     def update_spectrogram(self, spectrogram_data) -> None:
         self._ensure_references()
@@ -314,6 +332,11 @@ class GUI(Module, App):
         self.main_layout: Optional[MainLayout] = None
         self._name_popup: Optional[Popup] = None
         self._name_input: Optional[TextInput] = None
+        # Only the latest image and analysis result are rendered; older ones still waiting
+        # for the Kivy clock are superseded instead of being drawn one after the other
+        self._pending_lock = Lock()
+        self._pending_image: Optional[numpy.ndarray] = None
+        self._pending_analysis = None
 
     def build(self):
         self.main_layout = MainLayout()
@@ -397,8 +420,12 @@ class GUI(Module, App):
             image_b64 = payload.get("image")
             if image_b64:
                 try:
+                    # Decoded here, on the message thread, so the Kivy main thread only uploads the texture
                     image_bytes = base64.b64decode(image_b64)
-                except (ValueError, TypeError) as exc:
+                    frame = cv2.imdecode(numpy.frombuffer(image_bytes, dtype=numpy.uint8), cv2.IMREAD_COLOR)
+                    if frame is None:
+                        raise ValueError("not a valid JPEG image")
+                except (ValueError, TypeError, cv2.error) as exc:
                     self.log("ERROR", f"Failed to decode image: {exc}")
                     Clock.schedule_once(
                         lambda _dt, text=f"Error decoding the image: {exc}": self._append_cli_text(text),
@@ -406,7 +433,11 @@ class GUI(Module, App):
                     )
                 else:
                     self.log("INFO", "Updating image")
-                    Clock.schedule_once(lambda _dt, data=image_bytes: self._update_image(data))
+                    with self._pending_lock:
+                        schedule = self._pending_image is None
+                        self._pending_image = frame
+                    if schedule:
+                        Clock.schedule_once(self._flush_image)
                     Clock.schedule_once(
                         lambda _dt: self._append_cli_text("Image captured by the camera module."),
                         0,
@@ -419,6 +450,8 @@ class GUI(Module, App):
         elif msg_type == "AnalysisComplete":
             self.log("INFO", "Analysis complete")
             spectrogram = payload.get("spectrogram_data") or []
+            if payload.get("spectrogram_encoding") == "float32_base64" and isinstance(spectrogram, str):
+                spectrogram = numpy.frombuffer(base64.b64decode(spectrogram), dtype=numpy.float32)
             substances_payload = payload.get("identified_substances")
             if isinstance(substances_payload, (list, tuple, set)):
                 substances = list(substances_payload)
@@ -426,9 +459,11 @@ class GUI(Module, App):
                 substances = [substances_payload]
             else:
                 substances = []
-            Clock.schedule_once(
-                lambda _dt, data=spectrogram, labels=substances: self._apply_analysis_results(data, labels)
-            )
+            with self._pending_lock:
+                schedule = self._pending_analysis is None
+                self._pending_analysis = (spectrogram, substances)
+            if schedule:
+                Clock.schedule_once(self._flush_analysis)
             summary_items = [str(item) for item in substances if item]
             summary = ", ".join(summary_items) if summary_items else "no substances detected"
             Clock.schedule_once(
@@ -466,17 +501,28 @@ class GUI(Module, App):
         elif msg_type == "RequestName":
             Clock.schedule_once(lambda _dt: self._show_substance_name_popup(), 0)
 
-    def _update_image(self, image_bytes: bytes) -> None:
+    def _flush_image(self, _dt) -> None:
+        with self._pending_lock:
+            frame, self._pending_image = self._pending_image, None
+        if frame is not None:
+            self._update_image(frame)
+
+    def _flush_analysis(self, _dt) -> None:
+        with self._pending_lock:
+            pending, self._pending_analysis = self._pending_analysis, None
+        if pending is not None:
+            self._apply_analysis_results(*pending)
+
+    def _update_image(self, frame: numpy.ndarray) -> None:
         if self.main_layout is None:
             return
-        self.main_layout.set_image_from_bytes(image_bytes)
+        self.main_layout.set_image_from_frame(frame)
 
     def _apply_analysis_results(self, spectrogram_data, substances) -> None:
         if self.main_layout is None:
             return
-        data_list = list(spectrogram_data) if spectrogram_data is not None else []
         substances_list = list(substances) if substances is not None else []
-        self.main_layout.update_spectrogram(data_list)
+        self.main_layout.update_spectrogram(spectrogram_data)
         self.main_layout.update_substances(substances_list)
 
     def _handle_analysis_error(self, message: str) -> None:
@@ -83,6 +83,12 @@ class LightSource(Module):
                 self.log("WARNING",f"'Dim' command received with invalid payload: {payload}")
         elif msgType == "SetColor":
             self.setColor(payload.get("r"),payload.get("g"),payload.get("b"))
+        elif msgType == "SetColorAndBrightness":
+            newBrightness = payload.get("brightness")
+            if isinstance(newBrightness,int) and 0 <= newBrightness <= 255:
+                self.setColorAndBrightness(payload.get("r"),payload.get("g"),payload.get("b"),newBrightness)
+            else:
+                self.log("WARNING",f"'SetColorAndBrightness' command received with invalid payload: {payload}")
 
     def turnOn(self):
         """
@@ -161,6 +167,32 @@ class LightSource(Module):
         self.sendMessage("All", "ColorSet", {"r": r, "g": g, "b": b})
         self.log("INFO", "LED color set successfully.")
 
+    def setColorAndBrightness(self, r, g, b, brightness):
+        """
+        Sets the RGB color and the global brightness of the LED in a single update.
+
+        Args:
+            r (int): The red color component (0-255).
+            g (int): The green color component (0-255).
+            b (int): The blue color component (0-255).
+            brightness (int): New brightness level (0-255).
+        """
+        if not self.led:
+            self.log("WARNING", "Cannot set color, light source not available.")
+            return
+
+        self.log("INFO", f"Setting LED color to R:{r}, G:{g}, B:{b} and brightness to {brightness}...")
+        self.r, self.g, self.b = r, g, b
+        self.color      = Color(self.b,self.g,self.r)
+        self.brightness = brightness
+        self.led.setBrightness(self.brightness)
+        self.led.setPixelColor(0,self.color)
+        self.led.show()
+        self.is_on = True
+
+        self.sendMessage("All", "ColorAndBrightnessSet", {"r": r, "g": g, "b": b, "brightness": self.brightness})
+        self.log("INFO", "LED color and brightness set successfully.")
+
     def onStop(self):
         """
         Ensures the LED is turned off when the module terminates.
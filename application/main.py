@@ -41,6 +41,7 @@ def main():
         "analysis"      : Analysis,
     }
     running_processes = []
+    gui_enabled = config['modules'].get('gui', {}).get('enabled', False)
     
     event_manager = EventManager(configPath=config_path)
     emProcess = Process(target=event_manager.run)
@@ -53,6 +54,9 @@ def main():
             module_config = config['modules'][name]
             network_config = config['network']
             system_config = config['system']
+            if name == "analysis":
+                # Nobody shows the ROI preview without the GUI: skip encoding it
+                module_config.setdefault("send_roi_preview", gui_enabled)
             
             instance = module_class(module_config, network_config, system_config)
             